@@ -1,22 +1,119 @@
-from fastapi import APIRouter, Body
-import baostock as bs
-import pandas as pd
-from typing import Dict, Any, List
-from pydantic import BaseModel
+from fastapi import APIRouter, Depends
+from fastapi.responses import ORJSONResponse
+import asyncio
+from typing import Dict, List, Literal, Union
+from pydantic import BaseModel, Field
 from app.utils.retry import async_retry_with_timeout
+from app.utils.validation import json_body, json_body_openapi
+from app.utils.cache import kline_cache, kline_cache_key, kline_ttl
+from app.utils.baostock_session import query_history_k_data
 
 router = APIRouter(tags=["股票K线数据"])
 
+# 字段映射：英文到中文，周线和月线的字段是日线字段的子集，共用同一映射
+FIELD_MAPPING = {
+    'date': '日期',
+    'code': '代码',
+    'open': '开盘价',
+    'high': '最高价',
+    'low': '最低价',
+    'close': '收盘价',
+    'preclose': '昨收价',
+    'volume': '成交量',
+    'amount': '成交额',
+    'adjustflag': '复权状态',
+    'turn': '换手率',
+    'tradestatus': '交易状态',
+    'pctChg': '涨跌幅',
+    'peTTM': '市盈率',
+    'psTTM': '市销率',
+    'pcfNcfTTM': '市现率',
+    'pbMRQ': '市净率',
+    'isST': '是否ST'
+}
+
+# 各周期查询的字段
+# 日线完整字段: "date,code,open,high,low,close,preclose,volume,amount,adjustflag,turn,tradestatus,pctChg,peTTM,psTTM,pcfNcfTTM,pbMRQ,isST"
+KLINE_FIELDS = {
+    "d": "date,code,open,high,low,close,preclose",
+    "w": "date,code,open,high,low,close,volume,amount,adjustflag,turn,pctChg",
+    "m": "date,code,open,high,low,close,volume,amount,adjustflag,turn,pctChg"
+}
+
 class StockDailyRequest(BaseModel):
     code: str
     start_date: str
     end_date: str
     adjustflag: str = "3"
 
-@router.post("/candlestick/daily")
-@async_retry_with_timeout()  # 添加装饰器
+# 批量查询单次最多允许的股票数量
+BATCH_MAX_CODES = 50
+
+class StockDailyBatchRequest(BaseModel):
+    codes: List[str] = Field(max_length=BATCH_MAX_CODES)
+    start_date: str
+    end_date: str
+    adjustflag: str = "3"
+
+# 添加周线和月线数据请求模型
+class StockPeriodRequest(BaseModel):
+    code: str
+    start_date: str
+    end_date: str
+    adjustflag: str = "3"
+
+# 请求体校验依赖，在模块加载时构建一次
+_DAILY_BODY = json_body(StockDailyRequest)
+_DAILY_BATCH_BODY = json_body(StockDailyBatchRequest)
+_PERIOD_BODY = json_body(StockPeriodRequest)
+
+async def _fetch_kline(
+    code: str, start_date: str, end_date: str, frequency: Literal['d', 'w', 'm'], adjustflag: str
+) -> Union[List[Dict[str, str]], Dict[str, str]]:
+    """
+    查询单只股票的K线数据，成功时返回记录列表，失败时返回包含error的字典
+    
+    参数:
+        frequency: K线周期，d=日线，w=周线，m=月线
+    """
+    fields = KLINE_FIELDS[frequency]
+    
+    # 优先从缓存读取
+    cache_key = kline_cache_key(code, start_date, end_date, frequency, adjustflag, fields)
+    cached = kline_cache.get(cache_key)
+    if cached is not None:
+        return cached
+    
+    # 查询历史数据（共享baostock会话，在线程中执行以免阻塞事件循环）
+    rs, data_list = await asyncio.to_thread(
+        query_history_k_data,
+        code, fields,
+        start_date,
+        end_date,
+        frequency,
+        adjustflag
+    )
+    
+    if rs is None or not hasattr(rs, 'error_code') or rs.error_code != '0':
+        error_msg = getattr(rs, 'error_msg', '未知错误')
+        return {"error": f"查询失败: {error_msg}"}
+    
+    # 检查是否有数据返回
+    if not data_list:
+        return {"error": "未查询到数据", "code": code}
+        
+    # 字段名映射为中文后直接组装记录，无需构建DataFrame
+    fields_list = rs.fields if hasattr(rs, 'fields') else fields.split(',')
+    cn_fields = [FIELD_MAPPING.get(field, field) for field in fields_list]
+    data = [dict(zip(cn_fields, row)) for row in data_list]
+    
+    kline_cache.set(cache_key, data, kline_ttl(end_date))
+    return data
+
+@router.post("/candlestick/daily", openapi_extra=json_body_openapi(StockDailyRequest))
+@async_retry_with_timeout(retry_on_timeout=False)  # 查询持有baostock会话锁，超时后不重试
 async def get_stock_daily(
-    request: StockDailyRequest = Body(...)
+    request: StockDailyRequest = Depends(_DAILY_BODY)
 ):
     """
     获取股票日线K线数据
@@ -29,84 +126,36 @@ async def get_stock_daily(
         "adjustflag": "3"
     }
     """
-    # 登录系统
-    lg = bs.login()
-    if lg.error_code != '0':
-        return {"error": f"登录失败: {lg.error_msg}"}
-    
-    try:
-        # 日线数据字段
-        # fields = "date,code,open,high,low,close,preclose,volume,amount,adjustflag,turn,tradestatus,pctChg,peTTM,psTTM,pcfNcfTTM,pbMRQ,isST"
-        fields = "date,code,open,high,low,close,preclose"
-        
-        # 查询历史数据
-        rs = bs.query_history_k_data_plus(
-            request.code, fields,
-            start_date=request.start_date, 
-            end_date=request.end_date,
-            frequency="d",  # 固定为日线
-            adjustflag=request.adjustflag
-        )
-        
-        if rs is None or not hasattr(rs, 'error_code') or rs.error_code != '0':
-            error_msg = getattr(rs, 'error_msg', '未知错误')
-            return {"error": f"查询失败: {error_msg}"}
-        
-        # 处理结果集
-        data_list = []
-        while (rs.error_code == '0') & rs.next():
-            data_list.append(rs.get_row_data())
-        
-        # 检查是否有数据返回
-        if not data_list:
-            return {"error": "未查询到数据", "code": request.code}
-            
-        # 转换为DataFrame
-        result = pd.DataFrame(data_list, columns=rs.fields)
-        
-        # 字段映射：英文到中文
-        field_mapping = {
-            'date': '日期',
-            'code': '代码',
-            'open': '开盘价',
-            'high': '最高价',
-            'low': '最低价',
-            'close': '收盘价',
-            'preclose': '昨收价',
-            'volume': '成交量',
-            'amount': '成交额',
-            'adjustflag': '复权状态',
-            'turn': '换手率',
-            'tradestatus': '交易状态',
-            'pctChg': '涨跌幅',
-            'peTTM': '市盈率',
-            'psTTM': '市销率',
-            'pcfNcfTTM': '市现率',
-            'pbMRQ': '市净率',
-            'isST': '是否ST'
-        }
-        
-        # 重命名列
-        result.rename(columns=field_mapping, inplace=True)
-        
-        # 转换为JSON格式
-        return result.to_dict('records')
-    
-    finally:
-        # 确保登出系统
-        bs.logout()
+    # 直接返回ORJSONResponse以跳过FastAPI的jsonable_encoder
+    return ORJSONResponse(await _fetch_kline(request.code, request.start_date, request.end_date, "d", request.adjustflag))
 
-# 添加周线和月线数据请求模型
-class StockPeriodRequest(BaseModel):
-    code: str
-    start_date: str
-    end_date: str
-    adjustflag: str = "3"
+@router.post("/candlestick/daily/batch", openapi_extra=json_body_openapi(StockDailyBatchRequest))
+@async_retry_with_timeout(timeout_seconds=300, retry_on_timeout=False)  # 批量查询耗时较长，放宽超时时间，超时后不重试
+async def get_stock_daily_batch(
+    request: StockDailyBatchRequest = Depends(_DAILY_BATCH_BODY)
+):
+    """
+    批量获取多只股票的日线K线数据，返回以股票代码为键的结果，
+    单只股票查询失败时对应的值为包含error的字典，单次最多查询 BATCH_MAX_CODES 只股票
+    
+    请求体示例:
+    {
+        "codes": ["sh.600000", "sz.000001"],
+        "start_date": "2024-01-01",
+        "end_date": "2024-01-31",
+        "adjustflag": "3"
+    }
+    """
+    # baostock全局只有一个连接，查询本身只能串行执行，逐只查询以免占用多个线程等待会话锁
+    results = {}
+    for code in request.codes:
+        results[code] = await _fetch_kline(code, request.start_date, request.end_date, "d", request.adjustflag)
+    return ORJSONResponse(results)
 
-@router.post("/candlestick/weekly")
-@async_retry_with_timeout()  # 添加装饰器
+@router.post("/candlestick/weekly", openapi_extra=json_body_openapi(StockPeriodRequest))
+@async_retry_with_timeout(retry_on_timeout=False)  # 查询持有baostock会话锁，超时后不重试
 async def get_stock_weekly(
-    request: StockPeriodRequest = Body(...)
+    request: StockPeriodRequest = Depends(_PERIOD_BODY)
 ):
     """
     获取股票周线K线数据
@@ -119,71 +168,12 @@ async def get_stock_weekly(
         "adjustflag": "3"
     }
     """
-    # 登录系统
-    lg = bs.login()
-    if lg is None or lg.error_code != '0':
-        return {"error": f"登录失败: {lg.error_msg if lg is not None else '未知错误'}"}
-    
-    try:
-        # 周线数据字段
-        fields = "date,code,open,high,low,close,volume,amount,adjustflag,turn,pctChg"
-        
-        # 查询历史数据
-        rs = bs.query_history_k_data_plus(
-            request.code, fields,
-            start_date=request.start_date, 
-            end_date=request.end_date,
-            frequency="w",  # 固定为周线
-            adjustflag=request.adjustflag
-        )
-        
-        if rs is None or rs.error_code != '0':
-            return {"error": f"查询失败: {rs.error_msg if rs is not None else '未知错误'}"}
-        
-        # 处理结果集
-        data_list = []
-        fields_list = rs.fields if hasattr(rs, 'fields') else fields.split(',')
-        
-        while rs is not None and hasattr(rs, 'error_code') and rs.error_code == '0' and rs.next():
-            data_list.append(rs.get_row_data())
-        
-        # 检查是否有数据返回
-        if not data_list:
-            return {"error": "未查询到数据", "code": request.code}
-            
-        # 转换为DataFrame
-        result = pd.DataFrame(data_list, columns=fields_list)
-        
-        # 字段映射：英文到中文
-        field_mapping = {
-            'date': '日期',
-            'code': '代码',
-            'open': '开盘价',
-            'high': '最高价',
-            'low': '最低价',
-            'close': '收盘价',
-            'volume': '成交量',
-            'amount': '成交额',
-            'adjustflag': '复权状态',
-            'turn': '换手率',
-            'pctChg': '涨跌幅'
-        }
-        
-        # 重命名列
-        result.rename(columns=field_mapping, inplace=True)
-        
-        # 转换为JSON格式
-        return result.to_dict('records')
-    
-    finally:
-        # 确保登出系统
-        if 'bs' in globals() and hasattr(bs, 'logout'):
-            bs.logout()
+    return ORJSONResponse(await _fetch_kline(request.code, request.start_date, request.end_date, "w", request.adjustflag))
 
-@router.post("/candlestick/monthly")
-@async_retry_with_timeout()  # 添加装饰器
+@router.post("/candlestick/monthly", openapi_extra=json_body_openapi(StockPeriodRequest))
+@async_retry_with_timeout(retry_on_timeout=False)  # 查询持有baostock会话锁，超时后不重试
 async def get_stock_monthly(
-    request: StockPeriodRequest = Body(...)
+    request: StockPeriodRequest = Depends(_PERIOD_BODY)
 ):
     """
     获取股票月线K线数据
@@ -196,61 +186,4 @@ async def get_stock_monthly(
         "adjustflag": "3"
     }
     """
-    # 登录系统
-    lg = bs.login()
-    if lg.error_code != '0':
-        return {"error": f"登录失败: {lg.error_msg}"}
-    
-    try:
-        # 月线数据字段
-        fields = "date,code,open,high,low,close,volume,amount,adjustflag,turn,pctChg"
-        
-        # 查询历史数据
-        rs = bs.query_history_k_data_plus(
-            request.code, fields,
-            start_date=request.start_date, 
-            end_date=request.end_date,
-            frequency="m",  # 固定为月线
-            adjustflag=request.adjustflag
-        )
-        
-        if rs is None or not hasattr(rs, 'error_code') or rs.error_code != '0':
-            error_msg = getattr(rs, 'error_msg', '未知错误')
-            return {"error": f"查询失败: {error_msg}"}
-        
-        # 处理结果集
-        data_list = []
-        while (rs.error_code == '0') & rs.next():
-            data_list.append(rs.get_row_data())
-        
-        # 检查是否有数据返回
-        if not data_list:
-            return {"error": "未查询到数据", "code": request.code}
-            
-        # 转换为DataFrame
-        result = pd.DataFrame(data_list, columns=rs.fields)
-        
-        # 字段映射：英文到中文
-        field_mapping = {
-            'date': '日期',
-            'code': '代码',
-            'open': '开盘价',
-            'high': '最高价',
-            'low': '最低价',
-            'close': '收盘价',
-            'volume': '成交量',
-            'amount': '成交额',
-            'adjustflag': '复权状态',
-            'turn': '换手率',
-            'pctChg': '涨跌幅'
-        }
-        
-        # 重命名列
-        result.rename(columns=field_mapping, inplace=True)
-        
-        # 转换为JSON格式
-        return result.to_dict('records')
-    
-    finally:
-        # 确保登出系统
-        bs.logout()
\ No newline at end of file
+    return ORJSONResponse(await _fetch_kline(request.code, request.start_date, request.end_date, "m", request.adjustflag))
\ No newline at end of file
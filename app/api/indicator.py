@@ -1,25 +1,38 @@
-from fastapi import APIRouter, Body
+from fastapi import APIRouter, Depends
 import pandas as pd
 import numpy as np
+from numpy.lib.stride_tricks import sliding_window_view
 from datetime import datetime, timedelta
-import baostock as bs
+import asyncio
 from typing import Dict, Any, Optional
 from pydantic import BaseModel
 import logging
 from app.utils.retry import async_retry_with_timeout
+from app.utils.validation import json_body, json_body_openapi
+from app.utils.cache import (
+    kline_cache, kline_cache_key, kline_ttl,
+    indicator_cache, kdj_weekly_cache_key, CHINA_TZ
+)
+from app.utils.baostock_session import query_history_k_data
 
-# 配置日志
-logging.basicConfig(level=logging.INFO, format='%(asctime)s - %(name)s - %(levelname)s - %(message)s')
 logger = logging.getLogger(__name__)
 
 router = APIRouter(tags=["技术指标"])
 
+# KDJ计算使用的日线字段
+DAILY_FIELDS = "date,code,open,high,low,close,preclose"
+# 需要解析为数值的价格列
+PRICE_COLUMNS = ['open', 'high', 'low', 'close', 'preclose']
+
 class KDJRequest(BaseModel):
     code: str
 
-@router.post("/indicator/kdj/weekly")
-@async_retry_with_timeout()  # 添加装饰器
-async def get_weekly_kdj(request: KDJRequest = Body(...)):
+# 请求体校验依赖，在模块加载时构建一次
+_KDJ_BODY = json_body(KDJRequest)
+
+@router.post("/indicator/kdj/weekly", openapi_extra=json_body_openapi(KDJRequest))
+@async_retry_with_timeout(retry_on_timeout=False)  # 查询持有baostock会话锁，超时后不重试
+async def get_weekly_kdj(request: KDJRequest = Depends(_KDJ_BODY)):
     """
     计算并返回指定股票的周线KDJ值
     
@@ -28,64 +41,59 @@ async def get_weekly_kdj(request: KDJRequest = Body(...)):
         "code": "sh.600000"
     }
     """
-    logger.info(f"开始处理KDJ请求: {request.code}")
+    logger.info("开始处理KDJ请求: %s", request.code)
+    
+    # 本周的KDJ只在每个交易日K线入库后变化，期间直接返回缓存结果
+    cache_key = kdj_weekly_cache_key(request.code)
+    cached = indicator_cache.get(cache_key)
+    if cached is not None:
+        logger.info("命中缓存: %s", cache_key)
+        return cached
     
-    # 计算前推180天的日期
-    today = datetime.now()
+    # 计算前推180天的日期，按北京时间确定当天，与缓存过期时间的计算保持一致
+    today = datetime.now(CHINA_TZ)
     start_date = (today - timedelta(days=180)).strftime("%Y-%m-%d")
     end_date = today.strftime("%Y-%m-%d")
-    logger.info(f"查询日期范围: {start_date} 至 {end_date}")
+    logger.info("查询日期范围: %s 至 %s", start_date, end_date)
     
     # 获取日K线数据
     logger.info("开始获取日K线数据...")
-    daily_data = get_daily_data(request.code, start_date, end_date)
-    
-    if not daily_data:
-        logger.error("获取日K线数据失败: 返回数据为空")
-        return {"error": "获取日K线数据失败: 返回数据为空"}
+    daily_data = await fetch_daily_data(request.code, start_date, end_date)
     
     if isinstance(daily_data, dict) and "error" in daily_data:
-        logger.error(f"获取日K线数据失败: {daily_data['error']}")
+        logger.error("获取日K线数据失败: %s", daily_data['error'])
         return daily_data
     
-    logger.info(f"成功获取日K线数据，数据条数: {len(daily_data)}")
+    # 只接受get_daily_data构建的DataFrame，其他类型的值按无数据处理，避免在try之外抛出异常
+    if not isinstance(daily_data, pd.DataFrame) or daily_data.empty:
+        logger.error("获取日K线数据失败: 返回数据为空")
+        return {"error": "获取日K线数据失败: 返回数据为空"}
+    
+    logger.info("成功获取日K线数据，数据条数: %s", len(daily_data))
     
-    # 将日K线数据转换为DataFrame
     try:
-        df = pd.DataFrame(daily_data)
-        logger.info(f"DataFrame列: {df.columns.tolist()}")
+        # 缓存中的DataFrame会被多个请求共享，复制后再处理
+        df = daily_data.copy()
         
-        # 转换数据类型
-        for col in ['open', 'high', 'low', 'close', 'preclose']:
-            if col in df.columns:
-                df[col] = pd.to_numeric(df[col])
-            else:
-                logger.error(f"列 '{col}' 不在DataFrame中")
-                return {"error": f"数据格式错误: 缺少列 '{col}'"}
+        # 检查必需的列，价格列已在get_daily_data中解析为数值
+        missing = ', '.join(f"'{col}'" for col in ['date'] + PRICE_COLUMNS if col not in df.columns)
+        if missing:
+            logger.error("列 %s 不在DataFrame中", missing)
+            return {"error": f"数据格式错误: 缺少列 {missing}"}
         
         # 设置日期索引
-        if 'date' not in df.columns:
-            logger.error("列 'date' 不在DataFrame中")
-            return {"error": "数据格式错误: 缺少列 'date'"}
-            
         df['date'] = pd.to_datetime(df['date'])
         df.set_index('date', inplace=True)
         
         # 将日K线数据转换为周K线数据
         logger.info("开始转换为周K线数据...")
-        weekly_df = df.resample('W').agg({
-            'open': 'first',
-            'high': 'max',
-            'low': 'min',
-            'close': 'last',
-            'code': 'first'
-        })
-        logger.info(f"周K线数据条数: {len(weekly_df)}")
+        weekly_df = to_weekly(df)
+        logger.info("周K线数据条数: %s", len(weekly_df))
         
         # 计算KDJ指标
         logger.info("开始计算KDJ指标...")
         kdj_df = calculate_kdj(weekly_df)
-        logger.info(f"KDJ计算完成，数据条数: {len(kdj_df)}")
+        logger.info("KDJ计算完成，数据条数: %s", len(kdj_df))
         
         # 获取最新的KDJ值
         latest_kdj = kdj_df.iloc[-1].to_dict()
@@ -94,7 +102,7 @@ async def get_weekly_kdj(request: KDJRequest = Body(...)):
         for key in ['K', 'D', 'J']:
             if pd.isna(latest_kdj[key]):
                 latest_kdj[key] = None
-                logger.warning(f"检测到{key}值为NaN，已替换为None")
+                logger.warning("检测到%s值为NaN，已替换为None", key)
         
         # 构造返回结果，只有在值不为None时才进行四舍五入
         result = {
@@ -105,62 +113,92 @@ async def get_weekly_kdj(request: KDJRequest = Body(...)):
             "j": round(latest_kdj['J'], 2) if latest_kdj['J'] is not None else None
         }
         
-        logger.info(f"返回结果: {result}")
+        logger.info("返回结果: %s", result)
+        # 与日K线缓存使用相同的过期时间，入库延迟时最多1小时后重新计算
+        indicator_cache.set(cache_key, result, kline_ttl(end_date))
         return result
     
     except Exception as e:
-        logger.exception(f"处理数据时发生错误: {str(e)}")
+        logger.exception("处理数据时发生错误: %s", e)
         return {"error": f"处理数据时发生错误: {str(e)}"}
 
+def _daily_data_cache_key(code: str, start_date: str, end_date: str) -> str:
+    # 缓存的是DataFrame，与K线接口缓存的记录列表使用不同的键
+    return kline_cache_key(code, start_date, end_date, "d", "2", DAILY_FIELDS, kind="frame")
+
+async def fetch_daily_data(code: str, start_date: str, end_date: str):
+    """
+    获取日K线数据，缓存命中时直接在事件循环中返回，未命中时才在线程中查询baostock
+    """
+    cached = kline_cache.get(_daily_data_cache_key(code, start_date, end_date))
+    if cached is not None:
+        logger.info("命中缓存: 代码=%s, 开始日期=%s, 结束日期=%s", code, start_date, end_date)
+        return cached
+    return await asyncio.to_thread(get_daily_data, code, start_date, end_date)
+
 def get_daily_data(code: str, start_date: str, end_date: str):
     """
-    直接使用baostock获取日K线数据
+    使用baostock获取日K线数据，成功后写入缓存
+
+    该函数会阻塞，在协程中应通过 fetch_daily_data 调用
+
+    返回:
+    DataFrame, 日K线数据；失败时返回包含error的字典
     """
     try:
-        logger.info(f"使用baostock获取数据: 代码={code}, 开始日期={start_date}, 结束日期={end_date}")
+        logger.info("使用baostock获取数据: 代码=%s, 开始日期=%s, 结束日期=%s", code, start_date, end_date)
+        
+        # 查询历史数据（共享baostock会话）
+        rs, data_list = query_history_k_data(
+            code, DAILY_FIELDS,
+            start_date,
+            end_date,
+            "d",  # 日线
+            "2"  # 前复权
+        )
+        
+        if rs.error_code != '0':
+            logger.error("baostock查询失败: %s", rs.error_msg)
+            return {"error": f"baostock查询失败: {rs.error_msg}"}
         
-        # 登录系统
-        lg = bs.login()
-        if lg.error_code != '0':
-            logger.error(f"baostock登录失败: {lg.error_msg}")
-            return {"error": f"baostock登录失败: {lg.error_msg}"}
+        # 一次性构建DataFrame，直接返回给调用方，不再经过字典列表中转
+        data = pd.DataFrame.from_records(data_list, columns=rs.fields)
         
-        try:
-            # 查询历史数据
-            fields = "date,code,open,high,low,close,preclose"
-            rs = bs.query_history_k_data_plus(
-                code, fields,
-                start_date=start_date, 
-                end_date=end_date,
-                frequency="d",  # 日线
-                adjustflag="2"  # 前复权
-            )
-            
-            if rs.error_code != '0':
-                logger.error(f"baostock查询失败: {rs.error_msg}")
-                return {"error": f"baostock查询失败: {rs.error_msg}"}
-            
-            # 处理结果集
-            data_list = []
-            while (rs.error_code == '0') & rs.next():
-                data_list.append(rs.get_row_data())
-            
-            # 转换为DataFrame
-            result = pd.DataFrame(data_list, columns=rs.fields)
-            
-            # 转换为字典列表
-            data = result.to_dict('records')
-            logger.info(f"成功获取数据，条数: {len(data)}")
-            return data
-            
-        finally:
-            # 确保登出系统
-            bs.logout()
+        # 入库时一次性将价格字符串解析为float64，保持与KDJ计算相同的精度
+        data[PRICE_COLUMNS] = data[PRICE_COLUMNS].apply(pd.to_numeric, errors='coerce')
+        logger.info("成功获取数据，条数: %s", len(data))
+        if not data.empty:
+            kline_cache.set(_daily_data_cache_key(code, start_date, end_date), data, kline_ttl(end_date))
+        return data
     
     except Exception as e:
-        logger.exception(f"获取日K线数据失败: {str(e)}")
+        logger.exception("获取日K线数据失败: %s", e)
         return {"error": f"获取日K线数据失败: {str(e)}"}
 
+def to_weekly(df):
+    """
+    将日K线数据聚合为周K线数据
+    
+    参数:
+    df: DataFrame, 以日期为索引的日K线数据
+    
+    返回:
+    DataFrame, 以所在周周日为索引的周K线数据，没有交易日的周（如长假）不产生记录
+    """
+    # 以所在周周日的天数（自1970-01-01，周四）作为整数分组键，标签与resample('W')一致
+    days = df.index.values.astype('datetime64[D]').astype(np.int64)
+    week_end = days + 6 - (days + 3) % 7
+    weekly_df = df.groupby(week_end, sort=True).agg({
+        'open': 'first',
+        'high': 'max',
+        'low': 'min',
+        'close': 'last',
+        'code': 'first'
+    })
+    # 与resample一致，保持输入索引的时间精度
+    weekly_df.index = pd.to_datetime(weekly_df.index, unit='D').astype(df.index.dtype).rename('date')
+    return weekly_df
+
 def calculate_kdj(df, n=9, m1=3, m2=3):
     """
     计算KDJ指标
@@ -174,81 +212,69 @@ def calculate_kdj(df, n=9, m1=3, m2=3):
     返回:
     DataFrame, 包含KDJ值的DataFrame
     """
-    df = df.copy()
-    
-    # 添加调试信息，检查输入数据
-    logger.info(f"KDJ计算输入数据形状: {df.shape}")
-    logger.info(f"KDJ计算输入数据前5行: \n{df.head().to_string()}")
-    logger.info(f"KDJ计算输入数据后5行: \n{df.tail().to_string()}")
+    k, d, j = _kdj_core(
+        df['high'].to_numpy(dtype=np.float64),
+        df['low'].to_numpy(dtype=np.float64),
+        df['close'].to_numpy(dtype=np.float64),
+        n, m1, m2
+    )
     
-    # 检查是否有缺失值
-    missing_values = df[['high', 'low', 'close']].isna().sum()
-    logger.info(f"输入数据缺失值统计: {missing_values.to_dict()}")
+    # 一次性写入结果，不修改输入的DataFrame
+    result = df[['code']].copy()
+    result[['K', 'D', 'J']] = np.column_stack([k, d, j])
     
-    # 计算n日内的最高价和最低价
-    df['high_n'] = df['high'].rolling(n).max()
-    df['low_n'] = df['low'].rolling(n).min()
+    return result
+
+def _kdj_core(high, low, close, n, m1, m2):
+    """
+    在float64数组上计算KDJ指标
     
-    # 检查rolling计算结果
-    logger.info(f"Rolling计算后缺失值统计: high_n={df['high_n'].isna().sum()}, low_n={df['low_n'].isna().sum()}")
+    RSV无法计算的位置（窗口不足或价格缺失）K、D为50，其后的有效位置从50重新递推，
+    因此序列中间的缺失值也会影响之后直到最新一期的结果
     
-    # 计算RSV，添加更多错误处理
-    denominator = df['high_n'] - df['low_n']
-    zero_denominator = (denominator == 0).sum()
-    logger.info(f"分母为零的数量: {zero_denominator}")
+    返回:
+    tuple, (K, D, J) 三个numpy数组
+    """
+    # 计算n日内的最高价和最低价，前n-1个位置窗口不足，为NaN
+    high_n = np.full(len(high), np.nan)
+    low_n = np.full(len(low), np.nan)
+    if len(high) >= n:
+        high_n[n-1:] = sliding_window_view(high, n).max(axis=1)
+        low_n[n-1:] = sliding_window_view(low, n).min(axis=1)
     
     # 安全地计算RSV
-    df['RSV'] = np.where(
-        denominator != 0,
-        100 * (df['close'] - df['low_n']) / denominator,
-        50  # 当最高价等于最低价时，使用默认值50
-    )
+    denominator = high_n - low_n
+    with np.errstate(divide='ignore', invalid='ignore'):
+        rsv = np.where(
+            denominator != 0,
+            100 * (close - low_n) / denominator,
+            50.0  # 当最高价等于最低价时，使用默认值50
+        )
     
     # 对前n个值（无法计算rolling的）使用NaN
-    df.loc[df.index[:n-1], 'RSV'] = np.nan
-    
-    logger.info(f"RSV计算后的缺失值数量: {df['RSV'].isna().sum()}")
-    logger.info(f"RSV值范围: 最小={df['RSV'].min()}, 最大={df['RSV'].max()}")
-    
-    # 初始化K、D值
-    df['K'] = 50.0
-    df['D'] = 50.0
-    
-    # 计算K、D值
-    valid_indices = df.index[~df['RSV'].isna()]
-    logger.info(f"有效RSV值的数量: {len(valid_indices)}")
+    rsv[:n-1] = np.nan
     
-    if len(valid_indices) > 0:
-        # 确保第一个有效值使用初始值50
-        first_valid_idx = df.index.get_loc(valid_indices[0])
-        if first_valid_idx > 0:
-            df.loc[valid_indices[0], 'K'] = (m1-1) / m1 * 50 + 1 / m1 * df.loc[valid_indices[0], 'RSV']
-            df.loc[valid_indices[0], 'D'] = (m2-1) / m2 * 50 + 1 / m2 * df.loc[valid_indices[0], 'K']
-        
-        # 计算其余K、D值
-        for i in range(1, len(df)):
-            if i >= len(df) or i-1 >= len(df):
-                logger.warning(f"索引越界: i={i}, df长度={len(df)}")
-                continue
-                
-            if pd.isna(df.iloc[i]['RSV']):
-                logger.debug(f"跳过索引 {i}，因为RSV为NaN")
-                continue
-                
-            try:
-                df.loc[df.index[i], 'K'] = (m1-1) / m1 * df.loc[df.index[i-1], 'K'] + 1 / m1 * df.loc[df.index[i], 'RSV']
-                df.loc[df.index[i], 'D'] = (m2-1) / m2 * df.loc[df.index[i-1], 'D'] + 1 / m2 * df.loc[df.index[i], 'K']
-            except Exception as e:
-                logger.error(f"计算K/D值时出错，索引={i}: {str(e)}")
-    else:
+    valid = ~np.isnan(rsv)
+    if not valid.any():
         logger.warning("没有有效的RSV值，无法计算KDJ")
     
-    # 计算J值
-    df['J'] = 3 * df['K'] - 2 * df['D']
-    
-    # 检查最终结果
-    logger.info(f"KDJ计算结果前5行: \n{df[['code', 'K', 'D', 'J']].head().to_string()}")
-    logger.info(f"KDJ计算结果后5行: \n{df[['code', 'K', 'D', 'J']].tail().to_string()}")
-    logger.info(f"KDJ结果中的NaN值数量: K={df['K'].isna().sum()}, D={df['D'].isna().sum()}, J={df['J'].isna().sum()}")
+    # 计算K、D值：K为RSV的指数移动平均，D为K的指数移动平均
+    # 与原递推一致，第一行不参与递推，RSV缺失的位置K、D为50，之后以50为初始值重新递推
+    valid[:1] = False
+    k = _ewm_from_50(rsv, valid, m1)
+    d = _ewm_from_50(k, valid, m2)
     
-    return df[['code', 'K', 'D', 'J']]
\ No newline at end of file
+    return k, d, 3 * k - 2 * d
+
+def _ewm_from_50(values, valid, m):
+    """
+    对每段连续的有效值分别以50为初始值计算指数移动平均，即 y[i] = (m-1)/m * y[i-1] + values[i]/m，
+    其中每段第一个值的 y[i-1] 取50；无效位置的结果为50
+    """
+    result = np.full(len(values), 50.0)
+    # 有效段的起止位置
+    edges = np.flatnonzero(np.diff(np.concatenate(([0], valid.astype(np.int8), [0]))))
+    for start, end in zip(edges[::2], edges[1::2]):
+        run = pd.Series(np.concatenate(([50.0], values[start:end])))
+        result[start:end] = run.ewm(alpha=1 / m, adjust=False).mean().to_numpy()[1:]
+    return result
\ No newline at end of file
@@ -1,12 +1,19 @@
+import logging
 from fastapi import FastAPI
+from fastapi.responses import ORJSONResponse
 import uvicorn
 from app.api import health, candlestick, indicator
+from app.utils import baostock_session
+
+# 配置日志，只在应用入口配置一次；容器日志自带时间戳，不再格式化asctime
+logging.basicConfig(level=logging.INFO, format='%(name)s - %(levelname)s - %(message)s')
 
 # 创建FastAPI应用
 app = FastAPI(
     title="Stock data query API",
     description="股票数据查询API",
-    version="0.0.1"
+    version="0.0.1",
+    default_response_class=ORJSONResponse
 )
 
 # 注册路由
@@ -14,6 +21,16 @@ app.include_router(health.router)
 app.include_router(candlestick.router)
 app.include_router(indicator.router)
 
+@app.on_event("startup")
+def startup():
+    # 启动时登录baostock，所有请求共享同一会话
+    baostock_session.login()
+
+@app.on_event("shutdown")
+def shutdown():
+    # 关闭时登出baostock
+    baostock_session.logout()
+
 def main():
     # 打印版本信息
     print(f"Quant trading system starting... Version: {app.version}")
@@ -0,0 +1,79 @@
+import threading
+import logging
+import baostock as bs
+
+logger = logging.getLogger(__name__)
+
+# 用户未登录，需要重新登录
+BSERR_NO_LOGIN = "10001001"
+# 网络错误（1000200x），长连接断开后需要重新登录
+BSERR_NETWORK_PREFIX = "10002"
+
+# baostock全局只维护一个连接，所有调用都需要串行执行
+_lock = threading.Lock()
+
+
+def login():
+    """
+    登录baostock，应用启动时调用一次，所有请求共享该会话
+    """
+    with _lock:
+        lg = bs.login()
+    if lg.error_code != '0':
+        logger.error("baostock登录失败: %s", lg.error_msg)
+    return lg
+
+
+def logout():
+    """
+    登出baostock，应用关闭时调用
+    """
+    with _lock:
+        bs.logout()
+
+
+def _need_relogin(rs) -> bool:
+    error_code = getattr(rs, 'error_code', None)
+    if error_code is None:
+        return False
+    return error_code == BSERR_NO_LOGIN or error_code.startswith(BSERR_NETWORK_PREFIX)
+
+
+def query_history_k_data(code: str, fields: str, start_date: str, end_date: str, frequency: str, adjustflag: str):
+    """
+    使用共享会话查询历史K线数据，会话失效时重新登录并重试一次
+
+    该函数会阻塞，在协程中应通过 asyncio.to_thread 调用
+
+    返回:
+        (rs, data_list): baostock结果集和全部数据行
+    """
+    with _lock:
+        rs = bs.query_history_k_data_plus(
+            code, fields,
+            start_date=start_date,
+            end_date=end_date,
+            frequency=frequency,
+            adjustflag=adjustflag
+        )
+
+        if _need_relogin(rs):
+            logger.warning("baostock会话失效，重新登录: %s", rs.error_msg)
+            lg = bs.login()
+            if lg.error_code != '0':
+                logger.error("baostock重新登录失败: %s", lg.error_msg)
+                return lg, []
+            rs = bs.query_history_k_data_plus(
+                code, fields,
+                start_date=start_date,
+                end_date=end_date,
+                frequency=frequency,
+                adjustflag=adjustflag
+            )
+
+        if rs is None or rs.error_code != '0':
+            return rs, []
+
+        # 处理结果集，翻页时仍会访问网络，需要在锁内完成
+        data_list = [rs.get_row_data() for _ in iter(rs.next, False)]
+        return rs, data_list
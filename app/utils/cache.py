@@ -0,0 +1,96 @@
+from collections import OrderedDict
+from datetime import datetime, time as dtime, timedelta, timezone
+from threading import Lock
+from typing import Any, Optional
+import time
+
+# 已收盘区间的K线数据不会再变化，缓存1天；包含当天的区间数据在下次入库前不会变化，
+# 最多缓存1小时，以便入库延迟时也能及时刷新
+KLINE_TTL_CLOSED = 24 * 60 * 60
+KLINE_TTL_OPEN = 60 * 60
+
+# baostock在交易日17:30完成当日日K线入库，留出余量按18:00（北京时间）计算
+KLINE_UPDATE_TIME = dtime(18, 0)
+CHINA_TZ = timezone(timedelta(hours=8), "Asia/Shanghai")
+
+
+class TTLCache:
+    """
+    进程内带过期时间的LRU缓存
+
+    参数:
+        maxsize: 最大缓存条目数，超出后淘汰最久未使用的条目
+    """
+
+    def __init__(self, maxsize: int = 1024):
+        self.maxsize = maxsize
+        self._data = OrderedDict()
+        self._lock = Lock()
+
+    def get(self, key: str) -> Optional[Any]:
+        """获取缓存值，不存在或已过期时返回None"""
+        with self._lock:
+            item = self._data.get(key)
+            if item is None:
+                return None
+            expires_at, value = item
+            if expires_at <= time.monotonic():
+                del self._data[key]
+                return None
+            self._data.move_to_end(key)
+            return value
+
+    def set(self, key: str, value: Any, ttl: int) -> None:
+        """写入缓存值，ttl为过期时间（秒）"""
+        with self._lock:
+            self._data[key] = (time.monotonic() + ttl, value)
+            self._data.move_to_end(key)
+            while len(self._data) > self.maxsize:
+                self._data.popitem(last=False)
+
+
+def kline_cache_key(code: str, start_date: str, end_date: str, frequency: str, adjustflag: str, fields: str,
+                    kind: str = "records") -> str:
+    """
+    生成K线查询的缓存键
+
+    参数:
+        kind: 缓存值的类型，如接口返回的记录列表（records）或指标计算使用的DataFrame（frame），
+            同一查询不同类型的值使用不同的键，互不覆盖
+    """
+    return f"kline:{kind}:{frequency}:{adjustflag}:{code}:{start_date}:{end_date}:{fields}"
+
+
+def kline_ttl(end_date: str, now: Optional[datetime] = None) -> int:
+    """根据结束日期确定K线数据及其计算结果的缓存时间（秒）"""
+    now = now or datetime.now(CHINA_TZ)
+    today = now.strftime("%Y-%m-%d")
+    # 结束日期为空时baostock默认查询到最近交易日
+    if not end_date or end_date >= today:
+        return min(KLINE_TTL_OPEN, seconds_until_kline_update(now))
+    return KLINE_TTL_CLOSED
+
+
+def kdj_weekly_cache_key(code: str, now: Optional[datetime] = None) -> str:
+    """生成周线KDJ结果的缓存键，按股票代码和所在周的周一区分"""
+    today = (now or datetime.now(CHINA_TZ)).date()
+    monday = today - timedelta(days=today.weekday())
+    return f"kdj:weekly:{code}:{monday.isoformat()}"
+
+
+def seconds_until_kline_update(now: Optional[datetime] = None) -> int:
+    """距离下一次日K线数据入库的秒数，周末不入库，顺延至周一"""
+    now = now or datetime.now(CHINA_TZ)
+    update_at = datetime.combine(now.date(), KLINE_UPDATE_TIME, tzinfo=now.tzinfo)
+    if now >= update_at:
+        update_at += timedelta(days=1)
+    while update_at.weekday() >= 5:
+        update_at += timedelta(days=1)
+    return max(int((update_at - now).total_seconds()), 1)
+
+
+# K线查询结果缓存
+kline_cache = TTLCache(maxsize=1024)
+
+# 技术指标计算结果缓存
+indicator_cache = TTLCache(maxsize=1024)
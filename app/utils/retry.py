@@ -5,39 +5,31 @@ import logging
 
 logger = logging.getLogger(__name__)
 
-def async_retry_with_timeout(timeout_seconds: int = 60, max_retries: int = 3):
+def async_retry_with_timeout(timeout_seconds: int = 60, max_retries: int = 3, retry_on_timeout: bool = True):
     """
     异步函数超时重试装饰器
     
     参数:
         timeout_seconds: 超时时间（秒）
         max_retries: 最大重试次数
+        retry_on_timeout: 超时后是否重试。取消等待并不会终止 asyncio.to_thread 中的线程，
+            若该线程仍持有baostock会话锁，重试只会让新线程排队等待，此时应设为False
     """
     def decorator(func: Callable) -> Callable:
         @wraps(func)
         async def wrapper(*args, **kwargs) -> Any:
-            task = None  # 初始化task变量
             for attempt in range(max_retries):
                 try:
-                    # 创建一个任务
-                    task = asyncio.create_task(func(*args, **kwargs))
-                    # 等待任务完成，设置超时时间
-                    result = await asyncio.wait_for(task, timeout=timeout_seconds)
-                    return result
-                except asyncio.TimeoutError:
-                    logger.warning(f"函数 {func.__name__} 执行超时 (尝试 {attempt + 1}/{max_retries})")
-                    if attempt == max_retries - 1:
-                        logger.error(f"函数 {func.__name__} 达到最大重试次数")
+                    # 直接在当前任务中等待，超时后由asyncio.timeout取消，无需额外创建任务
+                    async with asyncio.timeout(timeout_seconds):
+                        return await func(*args, **kwargs)
+                except TimeoutError:
+                    logger.warning("函数 %s 执行超时 (尝试 %s/%s)", func.__name__, attempt + 1, max_retries)
+                    if not retry_on_timeout or attempt == max_retries - 1:
+                        logger.error("函数 %s 超时，不再重试", func.__name__)
                         raise
-                    # 取消当前任务
-                    if task:  # 确保task已定义再执行cancel
-                        task.cancel()
-                    try:
-                        await task
-                    except asyncio.CancelledError:
-                        pass
                 except Exception as e:
-                    logger.error(f"函数 {func.__name__} 执行出错: {str(e)}")
+                    logger.error("函数 %s 执行出错: %s", func.__name__, e)
                     raise
             return None
         return wrapper
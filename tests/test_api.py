@@ -0,0 +1,97 @@
+from datetime import datetime, timedelta
+
+import pandas as pd
+import pytest
+from fastapi.testclient import TestClient
+
+from app.api import candlestick, indicator
+from app.main import app
+from app.utils import baostock_session
+from app.utils.cache import CHINA_TZ, TTLCache
+
+
+class _ResultSet:
+    """模拟baostock结果集"""
+    error_code = '0'
+    error_msg = ''
+
+    def __init__(self, fields, rows):
+        self.fields = fields
+        self._rows = iter(rows)
+        self._row = None
+
+    def next(self):
+        self._row = next(self._rows, None)
+        return self._row is not None
+
+    def get_row_data(self):
+        return self._row
+
+
+def _query_history_k_data_plus(code, fields, start_date, end_date, frequency, adjustflag):
+    """模拟baostock查询，按交易日返回固定规律的价格"""
+    fields = fields.split(',')
+    rows = []
+    for i, date in enumerate(pd.bdate_range(start_date, end_date)):
+        price = 10 + i % 7 * 0.1
+        values = {
+            'date': date.strftime("%Y-%m-%d"), 'code': code,
+            'open': price, 'high': price + 0.2, 'low': price - 0.2, 'close': price + 0.1, 'preclose': price
+        }
+        rows.append([str(values.get(field, '')) for field in fields])
+    return _ResultSet(fields, rows)
+
+
+@pytest.fixture
+def client(monkeypatch):
+    monkeypatch.setattr(baostock_session.bs, 'query_history_k_data_plus', _query_history_k_data_plus)
+    cache = TTLCache()
+    monkeypatch.setattr(candlestick, 'kline_cache', cache)
+    monkeypatch.setattr(indicator, 'kline_cache', cache)
+    monkeypatch.setattr(indicator, 'indicator_cache', TTLCache())
+    # 不进入上下文，不触发启动时的baostock登录
+    return TestClient(app)
+
+
+def _kdj_date_range():
+    today = datetime.now(CHINA_TZ)
+    return (today - timedelta(days=180)).strftime("%Y-%m-%d"), today.strftime("%Y-%m-%d")
+
+
+def _post_daily(client):
+    start_date, end_date = _kdj_date_range()
+    return client.post("/candlestick/daily", json={
+        "code": "sh.600000", "start_date": start_date, "end_date": end_date, "adjustflag": "2"
+    })
+
+
+def _post_kdj(client):
+    return client.post("/indicator/kdj/weekly", json={"code": "sh.600000"})
+
+
+@pytest.mark.parametrize("kdj_first", [True, False])
+def test_daily_and_kdj_share_query_without_sharing_cache_entries(client, kdj_first):
+    # 日线接口与KDJ使用相同的代码、日期范围、复权方式和字段，缓存值类型不同，不能互相读取
+    if kdj_first:
+        kdj, daily = _post_kdj(client), _post_daily(client)
+    else:
+        daily, kdj = _post_daily(client), _post_kdj(client)
+
+    assert daily.status_code == 200
+    records = daily.json()
+    assert isinstance(records, list)
+    assert records[0]['代码'] == "sh.600000"
+
+    assert kdj.status_code == 200
+    assert set(kdj.json()) == {"code", "date", "k", "d", "j"}
+
+
+def test_kdj_rejects_cached_value_that_is_not_a_dataframe(client):
+    start_date, end_date = _kdj_date_range()
+    records = _post_daily(client).json()
+    indicator.kline_cache.set(indicator._daily_data_cache_key("sh.600000", start_date, end_date), records, 60)
+
+    response = _post_kdj(client)
+
+    assert response.status_code == 200
+    assert "error" in response.json()
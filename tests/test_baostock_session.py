@@ -0,0 +1,19 @@
+from types import SimpleNamespace
+
+import pytest
+
+from app.utils.baostock_session import _need_relogin
+
+
+@pytest.mark.parametrize("error_code, expected", [
+    ("0", False),
+    ("10001001", True),
+    ("10002007", True),
+    ("10004011", False),
+])
+def test_need_relogin(error_code, expected):
+    assert _need_relogin(SimpleNamespace(error_code=error_code)) is expected
+
+
+def test_need_relogin_without_result():
+    assert _need_relogin(None) is False
@@ -0,0 +1,66 @@
+from datetime import datetime
+
+import pytest
+
+from app.utils.cache import (
+    CHINA_TZ, KLINE_TTL_CLOSED, KLINE_TTL_OPEN,
+    TTLCache, kdj_weekly_cache_key, kline_ttl, seconds_until_kline_update
+)
+
+HOUR = 60 * 60
+
+
+def _china_time(*args):
+    return datetime(*args, tzinfo=CHINA_TZ)
+
+
+@pytest.mark.parametrize("now, expected", [
+    # 周三18:00前，当天入库
+    (_china_time(2024, 1, 10, 10, 0), 8 * HOUR),
+    # 周三18:00及之后，次日入库
+    (_china_time(2024, 1, 10, 18, 0), 24 * HOUR),
+    (_china_time(2024, 1, 10, 19, 0), 23 * HOUR),
+    # 周五18:00后，顺延至周一
+    (_china_time(2024, 1, 12, 19, 0), 71 * HOUR),
+    # 周末，顺延至周一
+    (_china_time(2024, 1, 13, 12, 0), 54 * HOUR),
+    (_china_time(2024, 1, 14, 23, 0), 19 * HOUR),
+])
+def test_seconds_until_kline_update(now, expected):
+    assert seconds_until_kline_update(now) == expected
+
+
+@pytest.mark.parametrize("now, monday", [
+    (_china_time(2024, 1, 8, 9, 0), "2024-01-08"),
+    (_china_time(2024, 1, 10, 19, 0), "2024-01-08"),
+    (_china_time(2024, 1, 14, 23, 0), "2024-01-08"),
+    (_china_time(2024, 1, 15, 0, 0), "2024-01-15"),
+])
+def test_kdj_weekly_cache_key(now, monday):
+    assert kdj_weekly_cache_key("sh.600000", now) == f"kdj:weekly:sh.600000:{monday}"
+
+
+def test_kline_ttl_open_range_is_capped():
+    # 距离入库不足1小时时以入库时间为准
+    assert kline_ttl("2024-01-10", _china_time(2024, 1, 10, 17, 30)) == HOUR // 2
+    # 入库后距离下次入库接近1天，仍最多缓存1小时
+    assert kline_ttl("2024-01-10", _china_time(2024, 1, 10, 19, 0)) == KLINE_TTL_OPEN
+    assert kline_ttl("", _china_time(2024, 1, 12, 19, 0)) == KLINE_TTL_OPEN
+
+
+def test_kline_ttl_closed_range():
+    assert kline_ttl("2024-01-09", _china_time(2024, 1, 10, 19, 0)) == KLINE_TTL_CLOSED
+
+
+def test_ttl_cache_expires_and_evicts_least_recently_used():
+    cache = TTLCache(maxsize=2)
+    cache.set("expired", 1, ttl=0)
+    assert cache.get("expired") is None
+
+    cache.set("a", 1, ttl=60)
+    cache.set("b", 2, ttl=60)
+    assert cache.get("a") == 1
+    cache.set("c", 3, ttl=60)
+    assert cache.get("b") is None
+    assert cache.get("a") == 1
+    assert cache.get("c") == 3
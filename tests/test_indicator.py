@@ -0,0 +1,168 @@
+from types import SimpleNamespace
+
+import numpy as np
+import pandas as pd
+import pytest
+
+from app.api import indicator
+from app.api.indicator import _kdj_core, calculate_kdj, to_weekly
+from app.utils.cache import TTLCache
+
+
+def _legacy_kdj(df, n=9, m1=3, m2=3):
+    """重构前calculate_kdj的逐行递推实现（去掉日志），作为对照"""
+    df = df.copy()
+    df['high_n'] = df['high'].rolling(n).max()
+    df['low_n'] = df['low'].rolling(n).min()
+    denominator = df['high_n'] - df['low_n']
+    df['RSV'] = np.where(
+        denominator != 0,
+        100 * (df['close'] - df['low_n']) / denominator,
+        50
+    )
+    df.loc[df.index[:n-1], 'RSV'] = np.nan
+
+    df['K'] = 50.0
+    df['D'] = 50.0
+    valid_indices = df.index[~df['RSV'].isna()]
+    if len(valid_indices) > 0:
+        first_valid_idx = df.index.get_loc(valid_indices[0])
+        if first_valid_idx > 0:
+            df.loc[valid_indices[0], 'K'] = (m1-1) / m1 * 50 + 1 / m1 * df.loc[valid_indices[0], 'RSV']
+            df.loc[valid_indices[0], 'D'] = (m2-1) / m2 * 50 + 1 / m2 * df.loc[valid_indices[0], 'K']
+        for i in range(1, len(df)):
+            if pd.isna(df.iloc[i]['RSV']):
+                continue
+            df.loc[df.index[i], 'K'] = (m1-1) / m1 * df.loc[df.index[i-1], 'K'] + 1 / m1 * df.loc[df.index[i], 'RSV']
+            df.loc[df.index[i], 'D'] = (m2-1) / m2 * df.loc[df.index[i-1], 'D'] + 1 / m2 * df.loc[df.index[i], 'K']
+    df['J'] = 3 * df['K'] - 2 * df['D']
+    return df[['code', 'K', 'D', 'J']]
+
+
+def _random_weekly(length, seed):
+    rng = np.random.default_rng(seed)
+    close = 10 + np.cumsum(rng.normal(0, 0.3, length))
+    high = close + rng.uniform(0, 0.5, length)
+    low = close - rng.uniform(0, 0.5, length)
+    index = pd.date_range("2024-01-07", periods=length, freq="W")
+    return pd.DataFrame({'code': 'sh.600000', 'high': high, 'low': low, 'close': close}, index=index)
+
+
+@pytest.mark.parametrize("length, nan_column, nan_position", [
+    (1, None, None),
+    (5, None, None),
+    (8, None, None),
+    (9, None, None),
+    (10, None, None),
+    (26, None, None),
+    (60, None, None),
+    # 中间出现缺失值时，原递推将K、D重置为50后重新开始
+    (26, 'close', 15),
+    (26, 'high', 12),
+    (60, 'low', 9),
+])
+def test_kdj_core_matches_legacy_recurrence(length, nan_column, nan_position):
+    df = _random_weekly(length, seed=length)
+    if nan_column is not None:
+        df.iloc[nan_position, df.columns.get_loc(nan_column)] = np.nan
+    expected = _legacy_kdj(df)
+
+    k, d, j = _kdj_core(
+        df['high'].to_numpy(), df['low'].to_numpy(), df['close'].to_numpy(), 9, 3, 3
+    )
+
+    np.testing.assert_allclose(k, expected['K'], rtol=0, atol=1e-9)
+    np.testing.assert_allclose(d, expected['D'], rtol=0, atol=1e-9)
+    np.testing.assert_allclose(j, expected['J'], rtol=0, atol=1e-9)
+
+
+def test_kdj_core_resets_to_50_at_interior_gap():
+    df = _random_weekly(26, seed=26)
+    high, low, close = df['high'].to_numpy(), df['low'].to_numpy(), df['close'].to_numpy()
+    k_full, d_full, j_full = _kdj_core(high, low, close, 9, 3, 3)
+
+    close = close.copy()
+    close[15] = np.nan
+    k, d, j = _kdj_core(high, low, close, 9, 3, 3)
+
+    assert k[15] == 50.0 and d[15] == 50.0 and j[15] == 50.0
+    np.testing.assert_array_equal(k[:15], k_full[:15])
+    # 缺失值之后从50重新递推，最新一期的结果也随之变化
+    assert k[-1] != k_full[-1] and j[-1] != j_full[-1]
+
+
+def test_kdj_core_matches_legacy_recurrence_without_window():
+    df = _random_weekly(12, seed=3)
+    expected = _legacy_kdj(df, n=1)
+
+    k, d, j = _kdj_core(
+        df['high'].to_numpy(), df['low'].to_numpy(), df['close'].to_numpy(), 1, 3, 3
+    )
+
+    np.testing.assert_allclose(k, expected['K'], rtol=0, atol=1e-9)
+    np.testing.assert_allclose(d, expected['D'], rtol=0, atol=1e-9)
+
+
+def test_kdj_core_flat_window_uses_default_rsv():
+    # 最高价等于最低价时RSV取50
+    df = _random_weekly(20, seed=0)
+    df.loc[df.index[:12], ['high', 'low', 'close']] = 10.0
+    expected = _legacy_kdj(df)
+
+    result = calculate_kdj(df)
+
+    pd.testing.assert_frame_equal(result, expected, check_exact=False, atol=1e-9)
+
+
+def _daily_with_holiday():
+    # 2024年春节休市：2月9日至2月16日，2月12日所在周（标签2月18日）没有交易日
+    dates = pd.bdate_range("2024-01-22", "2024-03-08")
+    dates = dates[(dates < "2024-02-09") | (dates > "2024-02-16")]
+    rng = np.random.default_rng(1)
+    close = 10 + np.cumsum(rng.normal(0, 0.2, len(dates)))
+    df = pd.DataFrame({
+        'code': 'sh.600000',
+        'open': close + rng.normal(0, 0.1, len(dates)),
+        'high': close + 0.3,
+        'low': close - 0.3,
+        'close': close
+    }, index=pd.DatetimeIndex(dates, name='date'))
+    return df
+
+
+@pytest.mark.parametrize("unit", ["s", "ns"])
+def test_to_weekly_matches_resample_labels_and_bars(unit):
+    daily = _daily_with_holiday()
+    daily.index = daily.index.astype(f"datetime64[{unit}]")
+
+    weekly = to_weekly(daily)
+
+    expected = daily.resample('W').agg({
+        'open': 'first',
+        'high': 'max',
+        'low': 'min',
+        'close': 'last',
+        'code': 'first'
+    }).dropna()
+    pd.testing.assert_frame_equal(weekly, expected, check_freq=False)
+
+
+def test_to_weekly_drops_empty_holiday_week():
+    weekly = to_weekly(_daily_with_holiday())
+
+    assert pd.Timestamp("2024-02-11") in weekly.index
+    assert pd.Timestamp("2024-02-18") not in weekly.index
+    assert pd.Timestamp("2024-02-25") in weekly.index
+    assert not weekly.isna().any().any()
+
+
+def test_get_daily_data_parses_prices_as_float64(monkeypatch):
+    rs = SimpleNamespace(error_code='0', error_msg='', fields=indicator.DAILY_FIELDS.split(','))
+    rows = [['2024-01-02', 'sh.600000', '7.01', '7.12', '6.98', '7.05', '7.00']]
+    monkeypatch.setattr(indicator, 'query_history_k_data', lambda *args: (rs, rows))
+    monkeypatch.setattr(indicator, 'kline_cache', TTLCache())
+
+    data = indicator.get_daily_data('sh.600000', '2024-01-01', '2024-01-02')
+
+    assert (data[indicator.PRICE_COLUMNS].dtypes == np.float64).all()
+    assert data['close'].iloc[0] == 7.05
@@ -0,0 +1,50 @@
+from fastapi import Depends, FastAPI
+from fastapi.testclient import TestClient
+from pydantic import BaseModel
+
+from app.utils.validation import json_body, json_body_openapi
+
+
+class Item(BaseModel):
+    code: str
+    count: int = 1
+
+
+app = FastAPI()
+
+
+@app.post("/items", openapi_extra=json_body_openapi(Item))
+async def create_item(item: Item = Depends(json_body(Item))):
+    return item.model_dump()
+
+
+client = TestClient(app)
+
+
+def test_json_body_valid():
+    response = client.post("/items", content=b'{"code": "sh.600000", "count": 2}')
+
+    assert response.status_code == 200
+    assert response.json() == {"code": "sh.600000", "count": 2}
+
+
+def test_json_body_invalid_returns_422_with_body_location():
+    response = client.post("/items", content=b'{"count": "x"}')
+
+    assert response.status_code == 422
+    errors = {tuple(error["loc"]): error["type"] for error in response.json()["detail"]}
+    assert errors == {("body", "code"): "missing", ("body", "count"): "int_parsing"}
+
+
+def test_json_body_malformed_json_returns_422():
+    response = client.post("/items", content=b'{"code": ')
+
+    assert response.status_code == 422
+    assert response.json()["detail"][0]["type"] == "json_invalid"
+
+
+def test_json_body_in_openapi_schema():
+    schema = client.get("/openapi.json").json()
+    request_body = schema["paths"]["/items"]["post"]["requestBody"]
+
+    assert request_body["content"]["application/json"]["schema"]["required"] == ["code"]